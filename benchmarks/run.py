@@ -0,0 +1,225 @@
+"""
+Reproducible benchmark suite for the inference pipeline.
+
+Generates randomly initialized models and synthetic region crops, so neither the
+private weights nor the dataset are needed, then micro-benchmarks each pipeline
+stage and runs end-to-end /predict through an in-process test client.
+
+Usage:
+    python -m benchmarks.run --output bench_results.json
+    python -m benchmarks.run --output new.json --compare bench_results.json --threshold 0.1
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("benchmarks")
+
+# Arguments that do not affect the measurements and are left out of the results
+UNRECORDED_ARGS = ("output", "compare", "threshold", "workdir", "allow_mismatch")
+
+# Result metadata that must match for a comparison to be meaningful
+COMPARABLE_META = ("params", "device", "torch_threads")
+
+
+def summarize(timings):
+    """Latency statistics in milliseconds"""
+    timings_ms = np.asarray(timings) * 1000.0
+    return {
+        "n": int(len(timings_ms)),
+        "mean_ms": float(timings_ms.mean()),
+        "median_ms": float(np.median(timings_ms)),
+        "p95_ms": float(np.percentile(timings_ms, 95)),
+        "min_ms": float(timings_ms.min()),
+    }
+
+
+def measure(fn, repeats, warmup=3):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def run_micro_benchmarks(backend, scan_ids, repeats):
+    """Time load_image, preprocess_image, FeatureExtractor.forward and RF predict_proba"""
+    import torch
+    from src.backend.config import SELECTED_REGIONS
+    from src.backend.utils import get_region_paths, load_image, preprocess_image
+
+    region = SELECTED_REGIONS[0]
+    path = get_region_paths(f"{scan_ids[0]}.jpg")[region]
+    image = load_image(path)
+    input_tensor = preprocess_image(image).to(backend.device)
+    features = np.random.default_rng(0).normal(size=(1, backend.rf_classifier.n_features_in_))
+
+    def forward():
+        with torch.no_grad():
+            if backend.shared_extractor is not None:
+                backend.shared_extractor(input_tensor, [region])
+            else:
+                backend.feature_extractors[region](input_tensor, return_embedding=True)
+        if backend.device.type == "cuda":
+            torch.cuda.synchronize()
+
+    return {
+        "load_image": measure(lambda: load_image(path), repeats),
+        "preprocess_image": measure(lambda: preprocess_image(image), repeats),
+        "feature_extractor_forward": measure(forward, repeats),
+        "rf_predict_proba": measure(lambda: backend.rf_classifier.predict_proba(features), repeats),
+    }
+
+
+def run_predict_benchmark(client, scan_ids, concurrency, n_requests):
+    """Post n_requests to /predict from `concurrency` threads"""
+    def post(i):
+        filename = f"{scan_ids[i % len(scan_ids)]}.jpg"
+        start = time.perf_counter()
+        response = client.post("/predict", files={"file": (filename, b"synthetic", "image/jpeg")})
+        elapsed = time.perf_counter() - start
+        response.raise_for_status()
+        return elapsed
+
+    post(0)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(post, range(n_requests)))
+    wall = time.perf_counter() - start
+    result = summarize(timings)
+    result["throughput_rps"] = n_requests / wall
+    return result
+
+
+def run(args):
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="bench-"))
+    # The backend reads its model and image locations at import time
+    os.environ["MODEL_DIR"] = str(workdir / "models")
+    os.environ["IMAGE_DIR"] = str(workdir / "images")
+    os.environ["EXTRACTOR"] = args.extractor
+    # Scans are requested repeatedly, so cached or shared results would hide the pipeline cost
+    if not args.result_cache:
+        os.environ["RESULT_CACHE_SIZE"] = "0"
+        os.environ["RESULT_COALESCING"] = "false"
+
+    import torch
+    from fastapi.testclient import TestClient
+    from benchmarks.synthetic import generate_models, generate_scans
+    from src.backend import main as backend
+
+    generate_models(workdir / "models", n_estimators=args.rf_estimators, seed=args.seed)
+    scan_ids = generate_scans(workdir / "images", n_scans=args.scans, size=args.image_size, seed=args.seed)
+    torch.manual_seed(args.seed)
+
+    results = {}
+    with TestClient(backend.app) as client:
+        results.update(run_micro_benchmarks(backend, scan_ids, args.repeats))
+        for concurrency in args.concurrency:
+            logger.info(f"Running /predict with concurrency {concurrency}")
+            results[f"predict_c{concurrency}"] = run_predict_benchmark(
+                client, scan_ids, concurrency, args.requests)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "torch": torch.__version__,
+            "device": str(backend.device),
+            "torch_threads": torch.get_num_threads(),
+            "params": {k: v for k, v in vars(args).items() if k not in UNRECORDED_ARGS},
+        },
+        "results": results,
+    }
+
+
+def meta_mismatches(current, baseline):
+    """Describe the settings that differ between two result files"""
+    mismatches = []
+    for key in COMPARABLE_META:
+        before = baseline.get("meta", {}).get(key)
+        after = current["meta"].get(key)
+        if before != after:
+            mismatches.append(f"{key}: baseline={before!r} current={after!r}")
+    return mismatches
+
+
+def compare(current, baseline, threshold):
+    """Flag benchmarks whose median latency grew by more than `threshold` (a fraction)"""
+    regressions = []
+    print(f"{'benchmark':<30}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["median_ms"]
+        after = result["median_ms"]
+        change = (after - before) / before
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{name:<30}{before:>14.3f}{after:>14.3f}{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inference pipeline on synthetic data")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Baseline results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Median latency increase (fraction) counted as a regression")
+    parser.add_argument("--allow-mismatch", action="store_true",
+                        help="Compare even if the baseline used different settings or hardware")
+    parser.add_argument("--workdir", help="Directory for synthetic models and scans (default: temporary)")
+    parser.add_argument("--scans", type=int, default=8)
+    parser.add_argument("--image-size", type=int, default=256)
+    parser.add_argument("--rf-estimators", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--extractor", choices=["ensemble", "shared"], default="ensemble",
+                        help="Region extractor the backend loads")
+    parser.add_argument("--result-cache", action="store_true",
+                        help="Keep the /predict result cache and request coalescing enabled")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    report = run(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        mismatches = meta_mismatches(report, baseline)
+        if mismatches:
+            print("Baseline was recorded with different settings:")
+            for mismatch in mismatches:
+                print(f"  {mismatch}")
+            if not args.allow_mismatch:
+                print("Refusing to compare; rerun with matching settings or pass --allow-mismatch")
+                sys.exit(2)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Randomly initialized models and synthetic region crops for benchmarking"""
+from pathlib import Path
+import logging
+
+import numpy as np
+import torch
+from PIL import Image
+from sklearn.ensemble import RandomForestClassifier
+
+from src.backend.config import SELECTED_REGIONS
+from src.backend.models import FeatureExtractor, SharedBackboneExtractor
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 256
+
+
+def generate_models(model_dir, n_estimators=100, seed=42):
+    """
+    Write random region extractors, a random shared-backbone extractor and a
+    random forest in the checkpoint formats load_models expects
+    """
+    model_dir = Path(model_dir)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    torch.manual_seed(seed)
+
+    state_dicts = {}
+    for region in SELECTED_REGIONS:
+        state_dicts[region] = FeatureExtractor(pretrained=False).state_dict()
+        torch.save(state_dicts[region], model_dir / f"resnet34_{region}_best.pth")
+    torch.save(SharedBackboneExtractor(SELECTED_REGIONS, pretrained=False).state_dict(),
+               model_dir / "shared_backbone_best.pth")
+
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(512, EMBEDDING_DIM * len(SELECTED_REGIONS))).astype(np.float32)
+    y = rng.integers(0, 2, size=len(X))
+    rf_classifier = RandomForestClassifier(n_estimators=n_estimators, random_state=seed).fit(X, y)
+    torch.save({
+        'models_dict': state_dicts,
+        'rf_classifier': rf_classifier,
+        'metrics': (0, 0, 0, 0, 0)
+    }, model_dir / "mSegResRF_SPECT_final.pth")
+    logger.info(f"Wrote synthetic models to {model_dir}")
+
+
+def generate_scans(image_dir, n_scans=8, size=256, seed=42):
+    """Write grayscale JPEG crops as <image_dir>/<region>/<scan_id>.jpg and return the scan ids"""
+    image_dir = Path(image_dir)
+    rng = np.random.default_rng(seed)
+    scan_ids = [f"synthetic_{i:05d}" for i in range(n_scans)]
+    for region in SELECTED_REGIONS:
+        region_dir = image_dir / region
+        region_dir.mkdir(parents=True, exist_ok=True)
+        for scan_id in scan_ids:
+            pixels = rng.integers(0, 256, size=(size, size), dtype=np.uint8)
+            Image.fromarray(pixels).save(region_dir / f"{scan_id}.jpg", quality=90)
+    logger.info(f"Wrote {n_scans} synthetic scans to {image_dir}")
+    return scan_ids
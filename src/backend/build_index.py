@@ -0,0 +1,61 @@
+"""
+Build or extend the similar-case index over the reference dataset.
+
+Usage:
+    python -m src.backend.build_index --data-dir /data/bs-80k/temp
+    python -m src.backend.build_index --data-dir /path/to/new/scans --append
+"""
+import argparse
+import logging
+
+import numpy as np
+
+from .config import DATA_DIR, EXTRACTOR, INDEX_DIR, INDEX_NLIST, INDEX_SUBQUANTIZERS
+from .index import EmbeddingIndex
+from .main import load_models, extract_features_batch
+from .utils import load_reference_scans
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the similar-case embedding index")
+    parser.add_argument("--data-dir", default=str(DATA_DIR), help="Reference dataset root")
+    parser.add_argument("--output", default=str(INDEX_DIR), help="Index directory")
+    parser.add_argument("--append", action="store_true",
+                        help="Insert scans into an existing index instead of rebuilding it")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    scans = load_reference_scans(args.data_dir)
+    if not scans:
+        raise SystemExit(f"No labeled scans found in {args.data_dir}")
+
+    if args.append:
+        index = EmbeddingIndex.load(args.output, mmap=False)
+        if index.extractor != EXTRACTOR:
+            raise SystemExit(f"Index at {args.output} was built with the '{index.extractor}' extractor, "
+                             f"not '{EXTRACTOR}'; rebuild it instead of appending")
+
+    load_models()
+    scan_ids = [scan_id for scan_id, _, _ in scans]
+    labels = np.array([label for _, label, _ in scans])
+    embeddings = extract_features_batch([paths for _, _, paths in scans], batch_size=args.batch_size)
+
+    if args.append:
+        known = set(index.ids.tolist())
+        keep = np.array([scan_id not in known for scan_id in scan_ids])
+        logger.info(f"Appending {int(keep.sum())} new scans ({int((~keep).sum())} already indexed)")
+        index.add(embeddings[keep], np.array(scan_ids)[keep], labels[keep])
+    else:
+        index = EmbeddingIndex(embeddings.shape[1], nlist=min(INDEX_NLIST, len(scans)), m=INDEX_SUBQUANTIZERS)
+        index.extractor = EXTRACTOR
+        index.train(embeddings)
+        index.add(embeddings, scan_ids, labels)
+
+    index.save(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+def file_fingerprint(paths):
+    """Identify file contents cheaply by path, modification time and size"""
+    fingerprint = []
+    for path in paths:
+        stat = Path(path).stat()
+        fingerprint.append((str(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+
+class ResultCache:
+    """Bounded LRU cache whose entries expire `ttl` seconds after insertion"""
+
+    def __init__(self, maxsize=1024, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"size": len(self._entries), "maxsize": self.maxsize, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses}
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key onto one in-flight computation"""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._inflight = {}
+
+    async def do(self, key, fn):
+        """
+        Await fn() unless a call with the same key is already running, in which
+        case wait for its result instead. Returns (result, coalesced).
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fn()
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._inflight[key]
+            if not future.done():
+                future.cancel()
+
+    def stats(self):
+        return {"in_flight": len(self._inflight), "coalesced": self.coalesced}
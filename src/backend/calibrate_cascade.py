@@ -0,0 +1,97 @@
+"""
+Train the cascade's auxiliary classifier on partial embeddings and calibrate its
+early-exit thresholds against the full FeatureExtractor + RF path.
+
+Usage:
+    python -m src.backend.calibrate_cascade --data-dir /data/bs-80k/temp --max-sensitivity-drop 0.01
+"""
+import argparse
+import json
+import logging
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from .cascade import Cascade, cascade_decisions, select_thresholds
+from .config import CASCADE_PATH, CASCADE_REGIONS, DATA_DIR, EXTRACTOR, SELECTED_REGIONS
+from .main import load_models, extract_features_batch
+from .utils import load_reference_scans
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def rates(decisions, labels):
+    return {
+        "sensitivity": float(decisions[labels == 1].mean()),
+        "specificity": float(1.0 - decisions[labels == 0].mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the early-exit cascade")
+    parser.add_argument("--data-dir", default=str(DATA_DIR), help="Reference dataset root")
+    parser.add_argument("--output", default=str(CASCADE_PATH))
+    parser.add_argument("--regions", nargs="+", default=CASCADE_REGIONS,
+                        help="Regions evaluated by the cheap first stage")
+    parser.add_argument("--max-sensitivity-drop", type=float, default=0.01,
+                        help="Largest allowed sensitivity loss versus the full path")
+    parser.add_argument("--max-specificity-drop", type=float, default=None,
+                        help="Enable early positive exits with this largest allowed specificity loss")
+    parser.add_argument("--calibration-fraction", type=float, default=0.5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    unknown = set(args.regions) - set(SELECTED_REGIONS)
+    if unknown:
+        raise SystemExit(f"Unknown regions: {sorted(unknown)}")
+
+    scans = load_reference_scans(args.data_dir)
+    if not scans:
+        raise SystemExit(f"No labeled scans found in {args.data_dir}")
+    labels = np.array([label for _, label, _ in scans])
+
+    rf_classifier = load_models()
+    features = extract_features_batch([paths for _, _, paths in scans], batch_size=args.batch_size)
+    full_decisions = (rf_classifier.predict_proba(features)[:, 1] > 0.5).astype(int)
+
+    embedding_dim = features.shape[1] // len(SELECTED_REGIONS)
+    columns = np.concatenate([
+        np.arange(SELECTED_REGIONS.index(region) * embedding_dim, (SELECTED_REGIONS.index(region) + 1) * embedding_dim)
+        for region in args.regions
+    ])
+    partial = features[:, columns]
+
+    train_idx, cal_idx = train_test_split(
+        np.arange(len(labels)), test_size=args.calibration_fraction, stratify=labels, random_state=42)
+    classifier = make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000, class_weight="balanced"))
+    classifier.fit(partial[train_idx], labels[train_idx])
+
+    scores = classifier.predict_proba(partial[cal_idx])[:, 1]
+    low_threshold, high_threshold = select_thresholds(
+        scores, full_decisions[cal_idx], labels[cal_idx],
+        args.max_sensitivity_drop, args.max_specificity_drop)
+
+    decisions = cascade_decisions(scores, full_decisions[cal_idx], low_threshold, high_threshold)
+    early_exit = scores < low_threshold
+    if high_threshold is not None:
+        early_exit |= scores >= high_threshold
+    exit_rate = float(early_exit.mean())
+    metrics = {
+        "n_calibration_scans": int(len(cal_idx)),
+        "full": rates(full_decisions[cal_idx], labels[cal_idx]),
+        "cascade": rates(decisions, labels[cal_idx]),
+        "early_exit_rate": exit_rate,
+        "expected_region_evaluations": len(args.regions) + (1.0 - exit_rate) * (len(SELECTED_REGIONS) - len(args.regions)),
+    }
+
+    Cascade(args.regions, classifier, low_threshold, high_threshold, metrics, EXTRACTOR).save(args.output)
+    logger.info(f"Saved cascade to {args.output} (low={low_threshold:.4f}, high={high_threshold})")
+    logger.info(json.dumps(metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import numpy as np
+import torch
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Cascade:
+    """
+    Early-exit stage evaluated on a subset of region embeddings.
+
+    An auxiliary classifier scores the concatenated embeddings of `regions`.
+    Scores below `low_threshold` return negative and scores at or above
+    `high_threshold` (if set) return positive without running the remaining
+    regions or the random forest. `extractor` names the region extractor whose
+    embeddings the classifier was trained on.
+    """
+
+    def __init__(self, regions, classifier, low_threshold, high_threshold=None, metrics=None,
+                 extractor='ensemble'):
+        self.regions = list(regions)
+        self.classifier = classifier
+        self.low_threshold = low_threshold
+        self.high_threshold = high_threshold
+        self.metrics = metrics or {}
+        self.extractor = extractor
+
+    def score(self, embeddings):
+        """Positive-class probability from a dict of region -> embedding arrays"""
+        partial = np.concatenate([np.asarray(embeddings[region]).reshape(1, -1) for region in self.regions], axis=1)
+        return float(self.classifier.predict_proba(partial)[0, 1])
+
+    def decision(self, score):
+        """Calibrated early-exit decision: 0 or 1 when confident, None to fall through"""
+        if score < self.low_threshold:
+            return 0
+        if self.high_threshold is not None and score >= self.high_threshold:
+            return 1
+        return None
+
+    def save(self, path):
+        torch.save({
+            'regions': self.regions,
+            'classifier': self.classifier,
+            'low_threshold': self.low_threshold,
+            'high_threshold': self.high_threshold,
+            'metrics': self.metrics,
+            'extractor': self.extractor,
+        }, path)
+
+    @classmethod
+    def load(cls, path):
+        data = torch.load(path, map_location='cpu')
+        logger.info(f"Loaded cascade over regions {data['regions']} with thresholds "
+                    f"low={data['low_threshold']}, high={data['high_threshold']}")
+        # Cascades saved before the extractor was recorded were trained on the ensemble
+        return cls(data['regions'], data['classifier'], data['low_threshold'],
+                   data['high_threshold'], data.get('metrics'), data.get('extractor', 'ensemble'))
+
+
+def cascade_decisions(scores, full_decisions, low_threshold, high_threshold=None):
+    """Final binary decisions when confident scores exit early and the rest use the full path"""
+    decisions = np.asarray(full_decisions).copy()
+    decisions[scores < low_threshold] = 0
+    if high_threshold is not None:
+        decisions[scores >= high_threshold] = 1
+    return decisions
+
+
+def select_thresholds(scores, full_decisions, labels, max_sensitivity_drop, max_specificity_drop=None):
+    """
+    Pick the widest early-exit band that keeps the cascade within the given
+    sensitivity (and optionally specificity) loss relative to the full path.
+
+    Returns (low_threshold, high_threshold); high_threshold is None when early
+    positive exits are disabled.
+    """
+    scores = np.asarray(scores)
+    labels = np.asarray(labels)
+    full_decisions = np.asarray(full_decisions)
+    candidates = np.unique(scores)
+
+    # Positives the full path catches but an early negative exit would miss;
+    # the sensitivity loss is the share of them scoring below the threshold
+    lost_scores = np.sort(scores[(labels == 1) & (full_decisions == 1)])
+    sensitivity_drop = np.searchsorted(lost_scores, candidates, side='left') / max((labels == 1).sum(), 1)
+    feasible = candidates[sensitivity_drop <= max_sensitivity_drop]
+    low_threshold = float(feasible.max()) if len(feasible) else 0.0
+
+    high_threshold = None
+    if max_specificity_drop is not None:
+        # Negatives the full path clears but an early positive exit would flag
+        gained_scores = np.sort(scores[(labels == 0) & (full_decisions == 0)])
+        specificity_drop = (len(gained_scores) - np.searchsorted(gained_scores, candidates, side='left')) / max((labels == 0).sum(), 1)
+        feasible = candidates[(specificity_drop <= max_specificity_drop) & (candidates >= low_threshold)]
+        if len(feasible):
+            high_threshold = float(feasible.min())
+
+    return low_threshold, high_threshold
@@ -7,8 +7,9 @@ load_dotenv()
 
 # Base paths
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
-MODEL_DIR = Path("data/models")
+MODEL_DIR = Path(os.getenv('MODEL_DIR', 'data/models'))
 DATA_DIR = Path('/data/bs-80k/temp')
+IMAGE_DIR = Path(os.getenv('IMAGE_DIR', 'data/images/temp'))
 
 # Model configuration
 SELECTED_REGIONS = [
@@ -20,6 +21,43 @@ SELECTED_REGIONS = [
     'kneeRANT'
 ]
 
+# Region feature extractor: 'ensemble' runs the six per-region ResNet34 models,
+# 'shared' runs the distilled shared-backbone model in their place
+EXTRACTOR = os.getenv('EXTRACTOR', 'ensemble')
+
+# Cascade inference: score a cheap subset of regions first and return early
+# when the auxiliary classifier is confident
+CASCADE_ENABLED = os.getenv('CASCADE', 'false').lower() == 'true'
+CASCADE_PATH = MODEL_DIR / "cascade.pth"
+CASCADE_REGIONS = ['chestLANT', 'chestRANT', 'pelvisANT']
+
+# Similar-case index configuration
+INDEX_DIR = Path("data/index")
+INDEX_NLIST = 256
+INDEX_SUBQUANTIZERS = 96
+INDEX_NPROBE = 16
+
+# Prediction result cache configuration
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 1024))
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', 3600))
+# Whether concurrent requests for the same scan share one computation
+RESULT_COALESCING = os.getenv('RESULT_COALESCING', 'true').lower() == 'true'
+
+# Largest accepted body for the binary region-array endpoint
+MAX_TENSOR_PAYLOAD_BYTES = int(os.getenv('MAX_TENSOR_PAYLOAD_BYTES', 64 * 1024 * 1024))
+# Largest number of scans accepted in one binary request
+MAX_TENSOR_BATCH = int(os.getenv('MAX_TENSOR_BATCH', 256))
+# Largest crop height or width, and largest total decoded size of all region arrays
+MAX_TENSOR_SIDE = int(os.getenv('MAX_TENSOR_SIDE', 1024))
+MAX_TENSOR_DECODED_BYTES = int(os.getenv('MAX_TENSOR_DECODED_BYTES', 256 * 1024 * 1024))
+
+# Request profiling configuration
+PROFILE_DIR = Path(os.getenv('PROFILE_DIR', 'data/profiles'))
+# Number of profiled requests whose traces are kept; older ones are deleted
+PROFILE_MAX_TRACES = int(os.getenv('PROFILE_MAX_TRACES', 20))
+# Admin endpoints and the X-Profile header are disabled unless this token is set
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
 # Image processing configuration
 IMAGE_SIZE = 256
 CROP_SIZE = 224
@@ -0,0 +1,279 @@
+"""
+Distill the six per-region ResNet34 extractors into a SharedBackboneExtractor
+and compare the two on throughput, memory and RF AUC.
+
+Usage:
+    python -m src.backend.distill --data-dir /data/bs-80k/temp --epochs 20
+    python -m src.backend.distill --data-dir /data/bs-80k/temp --compare-only
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import queue
+import resource
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import Dataset, DataLoader, Subset
+from sklearn.metrics import roc_auc_score
+
+from . import main as backend
+from .config import DATA_DIR, MODEL_DIR, SELECTED_REGIONS
+from .models import SharedBackboneExtractor
+from .utils import load_image, load_reference_scans, preprocess_image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class RegionCropDataset(Dataset):
+    """Returns all region crops of a scan stacked as a (regions, 3, H, W) tensor"""
+    def __init__(self, region_paths_list):
+        self.region_paths_list = region_paths_list
+
+    def __len__(self):
+        return len(self.region_paths_list)
+
+    def __getitem__(self, idx):
+        paths = self.region_paths_list[idx]
+        crops = torch.cat([preprocess_image(load_image(paths[region])) for region in SELECTED_REGIONS])
+        return crops, idx
+
+
+def embed_with_student(student, loader):
+    """Compute (N, 1536) RF input vectors with the shared-backbone model"""
+    student.eval()
+    features = []
+    with torch.no_grad():
+        for crops, _ in loader:
+            batch_size = len(crops)
+            embeddings = student(crops.flatten(0, 1).to(backend.device), SELECTED_REGIONS * batch_size)
+            features.append(embeddings.view(batch_size, -1).cpu().numpy())
+    return np.concatenate(features)
+
+
+def train_student(dataset, train_idx, val_idx, targets, args):
+    """Train the student to regress the teacher region embeddings"""
+    student = SharedBackboneExtractor(SELECTED_REGIONS).to(backend.device)
+    criterion = nn.MSELoss()
+    optimizer = optim.AdamW(student.parameters(), lr=args.lr)
+    train_loader = DataLoader(Subset(dataset, train_idx), batch_size=args.batch_size,
+                              shuffle=True, num_workers=args.num_workers)
+    val_loader = DataLoader(Subset(dataset, val_idx), batch_size=args.batch_size,
+                            shuffle=False, num_workers=args.num_workers)
+    targets = torch.from_numpy(targets).view(len(targets), len(SELECTED_REGIONS), -1)
+
+    best_loss = float("inf")
+    for epoch in range(args.epochs):
+        start = time.time()
+        student.train()
+        train_loss = 0.0
+        for crops, idx in train_loader:
+            batch_size = len(crops)
+            embeddings = student(crops.flatten(0, 1).to(backend.device), SELECTED_REGIONS * batch_size)
+            loss = criterion(embeddings.view(batch_size, len(SELECTED_REGIONS), -1),
+                             targets[idx].to(backend.device))
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            train_loss += loss.item() * batch_size
+        train_loss /= len(train_idx)
+
+        student.eval()
+        val_loss = 0.0
+        with torch.no_grad():
+            for crops, idx in val_loader:
+                batch_size = len(crops)
+                embeddings = student(crops.flatten(0, 1).to(backend.device), SELECTED_REGIONS * batch_size)
+                val_loss += criterion(embeddings.view(batch_size, len(SELECTED_REGIONS), -1),
+                                      targets[idx].to(backend.device)).item() * batch_size
+        val_loss /= len(val_idx)
+
+        logger.info(f"Epoch {epoch + 1}/{args.epochs}: train_loss={train_loss:.5f} "
+                    f"val_loss={val_loss:.5f} ({time.time() - start:.1f}s)")
+        if val_loss < best_loss:
+            best_loss = val_loss
+            torch.save(student.state_dict(), args.output)
+            logger.info(f"Saved best student to {args.output}")
+
+    student.load_state_dict(torch.load(args.output, map_location=backend.device))
+    return student
+
+
+def time_per_scan(fn, crops, repeats):
+    """Median seconds per scan for fn applied to one scan's (regions, 3, H, W) crops"""
+    with torch.no_grad():
+        fn(crops)
+        timings = []
+        for _ in range(repeats):
+            if backend.device.type == "cuda":
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            fn(crops)
+            if backend.device.type == "cuda":
+                torch.cuda.synchronize()
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def parameter_bytes(modules):
+    return int(sum(p.numel() * p.element_size() for m in modules for p in m.parameters()))
+
+
+def run_ensemble(x):
+    for i, region in enumerate(SELECTED_REGIONS):
+        backend.feature_extractors[region](x[i:i + 1], return_embedding=True)
+
+
+def _peak_rss_worker(variant, student_path, crops, results):
+    """Load one variant in a fresh process, embed one scan and report the peak RSS growth"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if variant == "ensemble":
+        backend.load_feature_extractors("ensemble")
+        fn = run_ensemble
+    else:
+        student = SharedBackboneExtractor(SELECTED_REGIONS, pretrained=False).to(backend.device)
+        student.load_state_dict(torch.load(student_path, map_location=backend.device))
+        student.eval()
+        fn = lambda x: student(x, SELECTED_REGIONS)
+    with torch.no_grad():
+        fn(crops.to(backend.device))
+    # ru_maxrss is reported in kilobytes on Linux
+    results.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) * 1024)
+
+
+def peak_inference_bytes(variant, fn, parameters, student_path, crops):
+    """
+    Peak memory needed to serve one scan with a variant, including its weights.
+    
+    On CUDA this is the variant's parameters plus the peak allocation during a
+    forward pass. On CPU each variant is loaded alone in a spawned process and
+    the growth of its peak resident set size is reported.
+    """
+    if backend.device.type == "cuda":
+        torch.cuda.synchronize()
+        allocated = torch.cuda.memory_allocated()
+        torch.cuda.reset_peak_memory_stats()
+        with torch.no_grad():
+            fn(crops)
+        torch.cuda.synchronize()
+        return int(parameters + torch.cuda.max_memory_allocated() - allocated)
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_peak_rss_worker, args=(variant, student_path, crops.cpu(), results))
+    process.start()
+    peak = None
+    # Poll so a worker that dies without reporting (missing checkpoint, OOM kill) fails fast
+    while peak is None and process.is_alive():
+        try:
+            peak = results.get(timeout=1)
+        except queue.Empty:
+            pass
+    if peak is None:
+        try:
+            peak = results.get(timeout=1)
+        except queue.Empty:
+            pass
+    process.join()
+    if peak is None or process.exitcode != 0:
+        raise RuntimeError(f"Peak memory measurement for the {variant} extractor failed "
+                           f"(exit code {process.exitcode})")
+    return int(peak)
+
+
+def compare(student, rf_classifier, teacher_features, student_features, labels, sample_crops, repeats,
+            student_path):
+    """Report throughput, memory, AUC and embedding fidelity of both variants"""
+    crops = sample_crops.to(backend.device)
+
+    def run_student(x):
+        student(x, SELECTED_REGIONS)
+
+    ensemble_time = time_per_scan(run_ensemble, crops, repeats)
+    student_time = time_per_scan(run_student, crops, repeats)
+    ensemble_parameters = parameter_bytes(backend.feature_extractors.values())
+    student_parameters = parameter_bytes([student])
+    ensemble_peak = peak_inference_bytes("ensemble", run_ensemble, ensemble_parameters, student_path, crops)
+    student_peak = peak_inference_bytes("shared", run_student, student_parameters, student_path, crops)
+
+    teacher_scores = rf_classifier.predict_proba(teacher_features)[:, 1]
+    student_scores = rf_classifier.predict_proba(student_features)[:, 1]
+    teacher_regions = teacher_features.reshape(len(labels), len(SELECTED_REGIONS), -1)
+    student_regions = student_features.reshape(len(labels), len(SELECTED_REGIONS), -1)
+    cosine = (teacher_regions * student_regions).sum(-1) / (
+        np.linalg.norm(teacher_regions, axis=-1) * np.linalg.norm(student_regions, axis=-1) + 1e-12)
+
+    return {
+        "device": str(backend.device),
+        "n_eval_scans": int(len(labels)),
+        "ensemble": {
+            "scans_per_second": 1.0 / ensemble_time,
+            "parameter_bytes": ensemble_parameters,
+            "peak_inference_bytes": ensemble_peak,
+            "auc": float(roc_auc_score(labels, teacher_scores)),
+        },
+        "shared": {
+            "scans_per_second": 1.0 / student_time,
+            "parameter_bytes": student_parameters,
+            "peak_inference_bytes": student_peak,
+            "auc": float(roc_auc_score(labels, student_scores)),
+        },
+        "speedup": ensemble_time / student_time,
+        "mean_region_cosine": float(cosine.mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the per-region extractors into a shared backbone")
+    parser.add_argument("--data-dir", default=str(DATA_DIR), help="Reference dataset root")
+    parser.add_argument("--output", default=str(MODEL_DIR / "shared_backbone_best.pth"))
+    parser.add_argument("--report", default=str(MODEL_DIR / "shared_backbone_comparison.json"))
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--lr", type=float, default=0.0001)
+    parser.add_argument("--num-workers", type=int, default=2)
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--timing-repeats", type=int, default=20)
+    parser.add_argument("--compare-only", action="store_true",
+                        help="Skip training and compare an existing student checkpoint")
+    args = parser.parse_args()
+
+    torch.manual_seed(42)
+    scans = load_reference_scans(args.data_dir)
+    if len(scans) < 2:
+        raise SystemExit(f"Not enough labeled scans found in {args.data_dir}")
+    region_paths_list = [paths for _, _, paths in scans]
+    labels = np.array([label for _, label, _ in scans])
+
+    rf_classifier = backend.load_models("ensemble")
+    teacher_features = backend.extract_features_batch(region_paths_list, batch_size=args.batch_size)
+
+    order = np.random.default_rng(42).permutation(len(scans))
+    n_val = max(1, int(len(scans) * args.val_fraction))
+    val_idx, train_idx = order[:n_val].tolist(), order[n_val:].tolist()
+    dataset = RegionCropDataset(region_paths_list)
+
+    if args.compare_only:
+        student = SharedBackboneExtractor(SELECTED_REGIONS, pretrained=False).to(backend.device)
+        student.load_state_dict(torch.load(args.output, map_location=backend.device))
+    else:
+        student = train_student(dataset, train_idx, val_idx, teacher_features, args)
+
+    val_loader = DataLoader(Subset(dataset, val_idx), batch_size=args.batch_size,
+                            shuffle=False, num_workers=args.num_workers)
+    student_features = embed_with_student(student, val_loader)
+    report = compare(student, rf_classifier, teacher_features[val_idx], student_features,
+                     labels[val_idx], dataset[val_idx[0]][0], args.timing_repeats, args.output)
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Comparison written to {args.report}: {json.dumps(report, indent=2)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import json
+import numpy as np
+from pathlib import Path
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of centroids per product-quantizer subspace (codes are stored as uint8)
+PQ_CENTROIDS = 256
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so that squared L2 distance ranks like cosine similarity"""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _nearest(x: np.ndarray, centroids: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+    """Return the index of the nearest centroid for every row of x"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assign = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk_size):
+        block = x[start:start + chunk_size]
+        # ||x||^2 is constant per row and does not change the argmin
+        dists = centroid_norms[None, :] - 2.0 * block @ centroids.T
+        assign[start:start + chunk_size] = dists.argmin(axis=1)
+    return assign
+
+
+def _kmeans(x: np.ndarray, k: int, n_iter: int = 20, seed: int = 42) -> np.ndarray:
+    """Plain Lloyd's k-means, returning a (k, d) float32 centroid matrix"""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=len(x) < k)].astype(np.float32)
+    for _ in range(n_iter):
+        assign = _nearest(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters with random points so every centroid stays useful
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), int(empty.sum()))]
+    return centroids
+
+
+class EmbeddingIndex:
+    """
+    IVF-PQ approximate nearest-neighbour index over scan embeddings.
+
+    Vectors are L2-normalized, assigned to one of `nlist` coarse partitions and
+    the residual to the partition centroid is product-quantized into `m` uint8
+    codes. A query only scans the `nprobe` closest partitions using asymmetric
+    distance lookup tables. With `store_vectors`, the normalized embeddings are
+    also kept as float16 (memory-mapped after loading) and used to re-rank the
+    best quantized candidates exactly.
+    """
+
+    def __init__(self, dim: int, nlist: int = 256, m: int = 96, store_vectors: bool = True):
+        if dim % m != 0:
+            raise ValueError(f"Embedding dimension {dim} is not divisible by {m} subquantizers")
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.dsub = dim // m
+        self.coarse_centroids = None
+        self.pq_centroids = None
+        self.codes = np.empty((0, m), dtype=np.uint8)
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.labels = np.empty(0, dtype=np.int8)
+        self.ids = np.empty(0, dtype=str)
+        self.vectors = np.empty((0, dim), dtype=np.float16) if store_vectors else None
+        self.extractor = None
+        self._lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.coarse_centroids is not None and self.pq_centroids is not None
+
+    def train(self, embeddings: np.ndarray, max_samples: int = 20000, seed: int = 42):
+        """Fit the coarse quantizer and the product quantizer on a sample of embeddings"""
+        x = _normalize(embeddings)
+        if len(x) > max_samples:
+            rng = np.random.default_rng(seed)
+            x = x[rng.choice(len(x), max_samples, replace=False)]
+        logger.info(f"Training coarse quantizer with {self.nlist} lists on {len(x)} vectors")
+        self.coarse_centroids = _kmeans(x, self.nlist, seed=seed)
+
+        residuals = x - self.coarse_centroids[_nearest(x, self.coarse_centroids)]
+        logger.info(f"Training product quantizer with {self.m} subspaces of {self.dsub} dims")
+        self.pq_centroids = np.stack([
+            _kmeans(residuals[:, j * self.dsub:(j + 1) * self.dsub], PQ_CENTROIDS, seed=seed + j)
+            for j in range(self.m)
+        ])
+
+    def _encode(self, residuals: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = residuals[:, j * self.dsub:(j + 1) * self.dsub]
+            codes[:, j] = _nearest(sub, self.pq_centroids[j])
+        return codes
+
+    def add(self, embeddings: np.ndarray, ids, labels):
+        """Insert embeddings with their scan ids and labels; can be called repeatedly"""
+        if not self.is_trained:
+            raise RuntimeError("Index must be trained before adding embeddings")
+        x = _normalize(embeddings).reshape(-1, self.dim)
+        ids = np.asarray(ids, dtype=str)
+        labels = np.asarray(labels, dtype=np.int8)
+        if not len(x) == len(ids) == len(labels):
+            raise ValueError("embeddings, ids and labels must have the same length")
+
+        assign = _nearest(x, self.coarse_centroids)
+        codes = self._encode(x - self.coarse_centroids[assign])
+
+        offset = len(self)
+        self.codes = np.concatenate([self.codes, codes])
+        self.assignments = np.concatenate([self.assignments, assign.astype(np.int32)])
+        self.labels = np.concatenate([self.labels, labels])
+        self.ids = np.concatenate([self.ids, ids])
+        if self.vectors is not None:
+            self.vectors = np.concatenate([self.vectors, x.astype(np.float16)])
+        for list_id in np.unique(assign):
+            rows = offset + np.flatnonzero(assign == list_id)
+            self._lists[list_id] = np.concatenate([self._lists[list_id], rows])
+
+    def search(self, query: np.ndarray, k: int = 5, nprobe: int = 16, rerank: int = 100):
+        """
+        Return up to k (id, label, similarity) tuples for the nearest stored scans.
+
+        The `rerank` best quantized candidates are re-scored with the stored
+        vectors, giving exact cosine similarities. Without stored vectors (or
+        with rerank=0) similarity is approximated from the quantized distance.
+        """
+        if not self.is_trained:
+            raise RuntimeError("Index is not trained")
+        q = _normalize(query).reshape(self.dim)
+        coarse_dists = ((self.coarse_centroids - q) ** 2).sum(axis=1)
+        probe = np.argsort(coarse_dists)[:min(nprobe, self.nlist)]
+
+        candidate_rows = []
+        candidate_dists = []
+        sub_index = np.arange(self.m)
+        for list_id in probe:
+            rows = self._lists[list_id]
+            if len(rows) == 0:
+                continue
+            residual = (q - self.coarse_centroids[list_id]).reshape(self.m, 1, self.dsub)
+            # (m, 256) table of distances from each query sub-vector to each code
+            lookup = ((self.pq_centroids - residual) ** 2).sum(axis=2)
+            candidate_rows.append(rows)
+            candidate_dists.append(lookup[sub_index, self.codes[rows]].sum(axis=1))
+
+        if not candidate_rows:
+            return []
+        rows = np.concatenate(candidate_rows)
+        dists = np.concatenate(candidate_dists)
+        if self.vectors is not None and rerank > 0:
+            shortlist = min(max(rerank, k), len(rows))
+            top = np.argpartition(dists, shortlist - 1)[:shortlist]
+            rows = rows[top]
+            # Squared L2 between unit vectors is 2 - 2 * cosine
+            dists = 2.0 - 2.0 * (self.vectors[rows].astype(np.float32) @ q)
+        k = min(k, len(rows))
+        top = np.argpartition(dists, k - 1)[:k]
+        top = top[np.argsort(dists[top])]
+        return [
+            (str(self.ids[rows[i]]), int(self.labels[rows[i]]), float(1.0 - dists[i] / 2.0))
+            for i in top
+        ]
+
+    def save(self, index_dir):
+        """Write the index as a directory of .npy arrays plus a JSON header"""
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        np.save(index_dir / "coarse_centroids.npy", self.coarse_centroids)
+        np.save(index_dir / "pq_centroids.npy", self.pq_centroids)
+        np.save(index_dir / "codes.npy", np.ascontiguousarray(self.codes))
+        np.save(index_dir / "assignments.npy", np.ascontiguousarray(self.assignments))
+        np.save(index_dir / "labels.npy", np.ascontiguousarray(self.labels))
+        np.save(index_dir / "ids.npy", np.ascontiguousarray(self.ids))
+        if self.vectors is not None:
+            np.save(index_dir / "vectors.npy", np.ascontiguousarray(self.vectors))
+        with open(index_dir / "index.json", "w") as f:
+            json.dump({"dim": self.dim, "nlist": self.nlist, "m": self.m, "count": len(self),
+                       "extractor": self.extractor}, f)
+        logger.info(f"Saved index with {len(self)} entries to {index_dir}")
+
+    @classmethod
+    def load(cls, index_dir, mmap: bool = True) -> "EmbeddingIndex":
+        """Load an index written by `save`, memory-mapping the per-scan arrays by default"""
+        index_dir = Path(index_dir)
+        with open(index_dir / "index.json") as f:
+            header = json.load(f)
+        has_vectors = (index_dir / "vectors.npy").exists()
+        index = cls(header["dim"], nlist=header["nlist"], m=header["m"], store_vectors=has_vectors)
+        # Indexes saved before the extractor was recorded were built from the ensemble
+        index.extractor = header.get("extractor", "ensemble")
+        mmap_mode = "r" if mmap else None
+        index.coarse_centroids = np.load(index_dir / "coarse_centroids.npy")
+        index.pq_centroids = np.load(index_dir / "pq_centroids.npy")
+        index.codes = np.load(index_dir / "codes.npy", mmap_mode=mmap_mode)
+        index.assignments = np.load(index_dir / "assignments.npy", mmap_mode=mmap_mode)
+        index.labels = np.load(index_dir / "labels.npy", mmap_mode=mmap_mode)
+        index.ids = np.load(index_dir / "ids.npy", mmap_mode=mmap_mode)
+        if has_vectors:
+            index.vectors = np.load(index_dir / "vectors.npy", mmap_mode=mmap_mode)
+
+        # Rebuild the inverted lists from the stored partition assignments
+        order = np.argsort(index.assignments, kind="stable")
+        bounds = np.cumsum(np.bincount(index.assignments, minlength=index.nlist))
+        index._lists = np.split(order, bounds[:-1])
+        logger.info(f"Loaded index with {len(index)} entries from {index_dir}")
+        return index
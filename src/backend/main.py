@@ -1,4 +1,6 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 import torch
 import pickle
@@ -7,10 +9,21 @@ from pathlib import Path
 import tempfile
 import shutil
 import logging
+import traceback
+import hashlib
+import secrets
+from typing import Optional
 
-from .models import FeatureExtractor
-from .utils import load_image, get_region_paths, preprocess_image
-from .config import MODEL_DIR, SELECTED_REGIONS
+from .models import FeatureExtractor, SharedBackboneExtractor
+from .cache import ResultCache, SingleFlight, file_fingerprint
+from .cascade import Cascade
+from .index import EmbeddingIndex
+from .profiling import RequestProfiler
+from .utils import load_image, get_region_paths, preprocess_image, preprocess_array, parse_region_arrays
+from .config import (
+    MODEL_DIR, SELECTED_REGIONS, EXTRACTOR, CASCADE_ENABLED, CASCADE_PATH, INDEX_DIR, INDEX_NPROBE,
+    PROFILE_DIR, PROFILE_MAX_TRACES, ADMIN_TOKEN, RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_COALESCING, MAX_TENSOR_PAYLOAD_BYTES
+)
 
 app = FastAPI(title="Bone Scan Analyzer API")
 
@@ -25,18 +38,36 @@ app.add_middleware(
 
 # Load models
 feature_extractors = {}
+shared_extractor = None
+cascade = None
+similarity_index = None
+profiler = RequestProfiler(PROFILE_DIR, max_traces=PROFILE_MAX_TRACES)
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+prediction_flights = SingleFlight()
+model_version = None
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 # Set up logging at the top of your file
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def load_models():
-    """Load all required models"""
-    try:
-        # Load feature extractors
+def load_feature_extractors(extractor=EXTRACTOR):
+    """Load the region feature extractors selected by the EXTRACTOR setting"""
+    global shared_extractor
+    if extractor == 'shared':
+        model = SharedBackboneExtractor(SELECTED_REGIONS, pretrained=False).to(device)
+        model.load_state_dict(
+            torch.load(
+                MODEL_DIR / "shared_backbone_best.pth",
+                map_location=device
+            )
+        )
+        model.eval()
+        shared_extractor = model
+        logger.info("Loaded shared-backbone region extractor")
+    elif extractor == 'ensemble':
         for region in SELECTED_REGIONS:
-            model = FeatureExtractor().to(device)
+            model = FeatureExtractor(pretrained=False).to(device)
             model.load_state_dict(
                 torch.load(
                     MODEL_DIR / f"resnet34_{region}_best.pth",
@@ -45,6 +76,14 @@ def load_models():
             )
             model.eval()
             feature_extractors[region] = model
+    else:
+        raise ValueError(f"Unknown extractor '{extractor}', expected 'ensemble' or 'shared'")
+
+def load_models(extractor=EXTRACTOR):
+    """Load all required models"""
+    try:
+        # Load feature extractors
+        load_feature_extractors(extractor)
             
         # Load Random Forest classifier
         model_data = torch.load(
@@ -93,15 +132,218 @@ def load_models():
         logger.error(f"Error loading models: {str(e)}")
         raise RuntimeError(f"Error loading models: {str(e)}")
 
+def embed_regions(region_tensors):
+    """
+    Run the region extractors on preprocessed crops.
+    
+    region_tensors maps region names to (B, 3, H, W) tensors and the result maps
+    the same names to (B, 256) embedding arrays.
+    """
+    regions = list(region_tensors)
+    with torch.no_grad():
+        if shared_extractor is not None:
+            with profiler.section("shared_extractor"):
+                batch = torch.cat([region_tensors[region] for region in regions]).to(device)
+                batch_regions = [region for region in regions for _ in range(len(region_tensors[region]))]
+                embeddings = shared_extractor(batch, batch_regions).cpu().numpy()
+            sizes = np.cumsum([len(region_tensors[region]) for region in regions])[:-1]
+            return dict(zip(regions, np.split(embeddings, sizes)))
+        embeddings = {}
+        for region in regions:
+            with profiler.section(f"region:{region}"):
+                embeddings[region] = feature_extractors[region](
+                    region_tensors[region].to(device), return_embedding=True
+                ).cpu().numpy()
+        return embeddings
+
+def extract_region_embeddings(region_paths, regions=SELECTED_REGIONS):
+    """Load, preprocess and embed the given regions, returning region -> (256,) arrays"""
+    region_tensors = {}
+    for region in regions:
+        logger.info(f"Processing region: {region}")
+        if region not in region_paths:
+            logger.error(f"Missing region image: {region}")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Missing region image: {region}"
+            )
+            
+        logger.info(f"Loading image from: {region_paths[region]}")
+        with profiler.section(f"pil_decode:{region}"):
+            image = load_image(region_paths[region])
+        logger.info(f"Preprocessing image for region: {region}")
+        with profiler.section(f"preprocess:{region}"):
+            region_tensors[region] = preprocess_image(image)
+        
+    logger.info(f"Extracting features for regions: {list(regions)}")
+    embeddings = embed_regions(region_tensors)
+    return {region: embedding.flatten() for region, embedding in embeddings.items()}
+
+def combine_features(embeddings):
+    """Concatenate region embeddings in SELECTED_REGIONS order into the RF input vector"""
+    logger.info("Combining features from all regions...")
+    combined_features = np.concatenate([embeddings[region] for region in SELECTED_REGIONS]).reshape(1, -1)
+    logger.info(f"Combined feature shape: {combined_features.shape}")
+    return combined_features
+
+def extract_features(region_paths):
+    """Extract region embeddings and concatenate them into the RF input vector"""
+    logger.info("Extracting features from regions...")
+    return combine_features(extract_region_embeddings(region_paths))
+
+def extract_features_batch(region_paths_list, batch_size=32):
+    """Extract RF input vectors for many scans at once, returning an (N, 1536) array"""
+    features = []
+    for start in range(0, len(region_paths_list), batch_size):
+        batch = region_paths_list[start:start + batch_size]
+        region_tensors = {
+            region: torch.cat([preprocess_image(load_image(paths[region])) for paths in batch])
+            for region in SELECTED_REGIONS
+        }
+        embeddings = embed_regions(region_tensors)
+        features.append(np.concatenate([embeddings[region] for region in SELECTED_REGIONS], axis=1))
+        logger.info(f"Extracted features for {start + len(batch)}/{len(region_paths_list)} scans")
+    return np.concatenate(features)
+
+def get_model_version():
+    """Fingerprint the loaded model files so cached results are tied to them"""
+    fingerprint = (EXTRACTOR, file_fingerprint(sorted(MODEL_DIR.glob("*.pth"))))
+    return hashlib.sha1(repr(fingerprint).encode()).hexdigest()[:12]
+
+def load_cascade():
+    """Load the calibrated cascade if it has been built"""
+    if not CASCADE_PATH.exists():
+        logger.warning(f"No cascade found at {CASCADE_PATH}, cascade mode is disabled")
+        return None
+    loaded = Cascade.load(CASCADE_PATH)
+    if loaded.extractor != EXTRACTOR:
+        logger.error(f"Cascade at {CASCADE_PATH} was trained on '{loaded.extractor}' embeddings but the "
+                     f"'{EXTRACTOR}' extractor is loaded, cascade mode is disabled")
+        return None
+    return loaded
+
+def load_similarity_index():
+    """Load the similar-case index if one has been built"""
+    if not (INDEX_DIR / "index.json").exists():
+        logger.warning(f"No similarity index found at {INDEX_DIR}, /similar is disabled")
+        return None
+    index = EmbeddingIndex.load(INDEX_DIR)
+    if index.extractor != EXTRACTOR:
+        logger.error(f"Similarity index at {INDEX_DIR} was built from '{index.extractor}' embeddings but the "
+                     f"'{EXTRACTOR}' extractor is loaded, /similar is disabled")
+        return None
+    return index
+
 @app.on_event("startup")
 async def startup_event():
-    global rf_classifier
+    global rf_classifier, cascade, similarity_index, model_version
     rf_classifier = load_models()
+    cascade = load_cascade()
+    model_version = get_model_version()
+    result_cache.clear()
+    similarity_index = load_similarity_index()
+
+def run_prediction(region_paths, use_cascade):
+    """Run the extractors and classifier for one scan"""
+    # Extract features from each region, starting with the cascade subset
+    if use_cascade:
+        embeddings = extract_region_embeddings(region_paths, cascade.regions)
+        with profiler.section("cascade"):
+            score = cascade.score(embeddings)
+        logger.info(f"Cascade score: {score}")
+        decision = cascade.decision(score)
+        if decision is not None:
+            # The auxiliary score is only meaningful relative to the calibrated
+            # thresholds, so report the decision and no class probabilities
+            logger.info("Cascade is confident, skipping remaining regions")
+            return {
+                "prediction": float(decision),
+                "probability_negative": None,
+                "probability_positive": None,
+                "cascade_score": score,
+                "path": "cascade",
+                "regions_evaluated": cascade.regions
+            }
+        remaining = [region for region in SELECTED_REGIONS if region not in embeddings]
+        embeddings.update(extract_region_embeddings(region_paths, remaining))
+        combined_features = combine_features(embeddings)
+    else:
+        combined_features = extract_features(region_paths)
+    
+    # Add error handling and debugging for the prediction step
+    logger.info("Making prediction with random forest classifier...")
+    try:
+        logger.info(f"RF classifier type: {type(rf_classifier)}")
+        
+        # Check if the model has the expected methods
+        if hasattr(rf_classifier, 'predict_proba'):
+            logger.info("RF classifier has predict_proba method")
+        else:
+            logger.error("RF classifier does not have predict_proba method")
+            
+        # Try to get the expected feature dimensions
+        if hasattr(rf_classifier, 'n_features_in_'):
+            logger.info(f"Expected feature dimensions: {rf_classifier.n_features_in_}")
+            logger.info(f"Actual feature dimensions: {combined_features.shape[1]}")
+        
+        with profiler.section("random_forest"):
+            prediction = rf_classifier.predict_proba(combined_features)[0]
+        logger.info(f"Prediction successful: {prediction}")
+    except Exception as e:
+        logger.error(f"Error during prediction: {str(e)}")
+        logger.error(f"Feature shape: {combined_features.shape}")
+        logger.error(f"RF classifier type: {type(rf_classifier)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        
+        # You can also write to a file for debugging
+        with open("debug_log.txt", "w") as f:
+            f.write(f"Error during prediction: {str(e)}\n")
+            f.write(f"Feature shape: {combined_features.shape}\n")
+            f.write(f"RF classifier type: {type(rf_classifier)}\n")
+            f.write(f"Traceback: {traceback.format_exc()}\n")
+        
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Error during prediction: {str(e)}"
+        )
+    
+    return {
+        "prediction": float(prediction[1]),
+        "probability_negative": float(prediction[0]),
+        "probability_positive": float(prediction[1]),
+        "path": "full",
+        "regions_evaluated": SELECTED_REGIONS
+    }
+
+def run_profiled_prediction(region_paths, use_cascade, profile_name):
+    """Run a prediction under the request profiler, returning the result and whether it was traced"""
+    with profiler.profile(profile_name) as traced:
+        result = run_prediction(region_paths, use_cascade)
+    return result, traced
+
+def prediction_cache_key(scan_id, region_paths, use_cascade):
+    """Key a /predict result by scan, region file metadata, loaded models and path"""
+    return (
+        scan_id,
+        file_fingerprint(region_paths[region] for region in sorted(region_paths)),
+        model_version,
+        use_cascade
+    )
 
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
+async def predict(
+    file: UploadFile = File(...),
+    use_cascade: Optional[bool] = None,
+    x_profile: Optional[str] = Header(None)
+):
     """Predict bone metastasis from whole body scan"""
     logger.info(f"Received prediction request for file: {file.filename}")
+    if use_cascade is None:
+        # Fall back to the full path when cascade mode is on but nothing is loaded
+        use_cascade = CASCADE_ENABLED and cascade is not None
+    elif use_cascade and cascade is None:
+        raise HTTPException(status_code=503, detail="Cascade mode is not available")
+    temp_path = None
     try:
         # Save uploaded file temporarily
         with tempfile.NamedTemporaryFile(delete=False) as temp_file:
@@ -120,84 +362,188 @@ async def predict(file: UploadFile = File(...)):
                 detail="Could not find corresponding region images"
             )
             
-        # Extract features from each region
-        logger.info("Extracting features from regions...")
-        features = []
-        for region in SELECTED_REGIONS:
-            logger.info(f"Processing region: {region}")
-            if region not in region_paths:
-                logger.error(f"Missing region image: {region}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Missing region image: {region}"
-                )
-                
-            logger.info(f"Loading image from: {region_paths[region]}")
-            image = load_image(region_paths[region])
-            logger.info(f"Preprocessing image for region: {region}")
-            input_tensor = preprocess_image(image).to(device)
-            
-            logger.info(f"Extracting features for region: {region}")
-            with torch.no_grad():
-                region_features = feature_extractors[region](input_tensor, return_embedding=True)
-                features.append(region_features.cpu().numpy().flatten())
-                logger.info(f"Features extracted for region {region}, shape: {region_features.shape}")
-                
-        # Combine features and predict
-        logger.info("Combining features from all regions...")
-        combined_features = np.concatenate(features).reshape(1, -1)
-        logger.info(f"Combined feature shape: {combined_features.shape}")
-        
-        # Add error handling and debugging for the prediction step
-        logger.info("Making prediction with random forest classifier...")
-        try:
-            logger.info(f"RF classifier type: {type(rf_classifier)}")
-            
-            # Check if the model has the expected methods
-            if hasattr(rf_classifier, 'predict_proba'):
-                logger.info("RF classifier has predict_proba method")
-            else:
-                logger.error("RF classifier does not have predict_proba method")
-                
-            # Try to get the expected feature dimensions
-            if hasattr(rf_classifier, 'n_features_in_'):
-                logger.info(f"Expected feature dimensions: {rf_classifier.n_features_in_}")
-                logger.info(f"Actual feature dimensions: {combined_features.shape[1]}")
-            
-            prediction = rf_classifier.predict_proba(combined_features)[0]
-            logger.info(f"Prediction successful: {prediction}")
-        except Exception as e:
-            import traceback
-            logger.error(f"Error during prediction: {str(e)}")
-            logger.error(f"Feature shape: {combined_features.shape}")
-            logger.error(f"RF classifier type: {type(rf_classifier)}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
-            
-            # You can also write to a file for debugging
-            with open("debug_log.txt", "w") as f:
-                f.write(f"Error during prediction: {str(e)}\n")
-                f.write(f"Feature shape: {combined_features.shape}\n")
-                f.write(f"RF classifier type: {type(rf_classifier)}\n")
-                f.write(f"Traceback: {traceback.format_exc()}\n")
-            
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Error during prediction: {str(e)}"
-            )
+        # Identical scans share cached results and in-flight computations
+        scan_id = Path(file.filename).stem
+        cache_key = prediction_cache_key(scan_id, region_paths, use_cascade)
+        if profiler.should_profile(is_admin_token(x_profile)):
+            # Profiled requests always run so the trace reflects real work
+            result, traced = await run_in_threadpool(run_profiled_prediction, region_paths, use_cascade, scan_id)
+            result_cache.put(cache_key, result)
+            cache_status = "profiled" if traced else "miss"
+        else:
+            result = result_cache.get(cache_key)
+            cache_status = "hit"
+            if result is None:
+                if RESULT_COALESCING:
+                    result, coalesced = await prediction_flights.do(
+                        cache_key,
+                        lambda: run_in_threadpool(run_prediction, region_paths, use_cascade)
+                    )
+                else:
+                    result = await run_in_threadpool(run_prediction, region_paths, use_cascade)
+                    coalesced = False
+                if coalesced:
+                    cache_status = "coalesced"
+                else:
+                    result_cache.put(cache_key, result)
+                    cache_status = "miss"
+        logger.info(f"Prediction cache status for {scan_id}: {cache_status}")
         
         # Return prediction results along with region paths
-        return {
-            "prediction": float(prediction[1]),
-            "probability_negative": float(prediction[0]),
-            "probability_positive": float(prediction[1]),
-            "region_paths": region_paths  # Include region paths in the response
-        }
+        return dict(result, cache=cache_status, region_paths=region_paths)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Unhandled exception: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         # Cleanup
-        Path(temp_path).unlink(missing_ok=True)
-        logger.info("Temporary file cleaned up") 
\ No newline at end of file
+        if temp_path is not None:
+            Path(temp_path).unlink(missing_ok=True)
+            logger.info("Temporary file cleaned up")
+
+def run_array_prediction(region_arrays, return_embedding=False, batch_size=32):
+    """Predict from in-memory region crops, skipping file I/O and image decoding"""
+    n_scans = len(region_arrays[SELECTED_REGIONS[0]])
+    features = []
+    for start in range(0, n_scans, batch_size):
+        region_tensors = {
+            region: preprocess_array(region_arrays[region][start:start + batch_size])
+            for region in SELECTED_REGIONS
+        }
+        embeddings = embed_regions(region_tensors)
+        features.append(np.concatenate([embeddings[region] for region in SELECTED_REGIONS], axis=1))
+    combined_features = np.concatenate(features)
+    logger.info(f"Combined feature shape: {combined_features.shape}")
+    predictions = rf_classifier.predict_proba(combined_features)
+    
+    results = []
+    for features, prediction in zip(combined_features, predictions):
+        result = {
+            "prediction": float(prediction[1]),
+            "probability_negative": float(prediction[0]),
+            "probability_positive": float(prediction[1])
+        }
+        if return_embedding:
+            result["embedding"] = features.tolist()
+        results.append(result)
+    return results
+
+@app.post("/predict/tensor")
+async def predict_tensor(request: Request, return_embedding: bool = False):
+    """
+    Predict from pre-cropped region arrays sent as a raw .npy or .npz body,
+    for one scan or a batch, in SELECTED_REGIONS order
+    """
+    # Refuse oversized bodies before buffering them
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > MAX_TENSOR_PAYLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    chunks = []
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > MAX_TENSOR_PAYLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Payload too large")
+        chunks.append(chunk)
+    payload = b"".join(chunks)
+    logger.info(f"Received tensor prediction request of {len(payload)} bytes")
+    try:
+        region_arrays = parse_region_arrays(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        results = await run_in_threadpool(run_array_prediction, region_arrays, return_embedding)
+    except Exception as e:
+        logger.error(f"Error during tensor prediction: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"results": results}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Result cache and request coalescing counters"""
+    return {
+        "model_version": model_version,
+        "result_cache": result_cache.stats(),
+        "single_flight": prediction_flights.stats()
+    }
+
+@app.post("/similar")
+async def similar(file: UploadFile = File(...), k: int = 5):
+    """Return the k most similar previously diagnosed scans"""
+    logger.info(f"Received similarity request for file: {file.filename}, k={k}")
+    if similarity_index is None:
+        raise HTTPException(status_code=503, detail="Similarity index is not available")
+    if k < 1:
+        raise HTTPException(status_code=400, detail="k must be a positive integer")
+
+    region_paths = get_region_paths(file.filename)
+    if not region_paths:
+        logger.error("Could not find corresponding region images")
+        raise HTTPException(
+            status_code=400,
+            detail="Could not find corresponding region images"
+        )
+
+    try:
+        combined_features = await run_in_threadpool(extract_features, region_paths)
+        # Ask for one extra result in case the query scan itself is indexed
+        scan_id = Path(file.filename).stem
+        neighbours = similarity_index.search(combined_features[0], k=k + 1, nprobe=INDEX_NPROBE)
+        neighbours = [neighbour for neighbour in neighbours if neighbour[0] != scan_id][:k]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error during similarity search: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "neighbours": [
+            {"scan_id": scan_id, "label": label, "similarity": score}
+            for scan_id, label, score in neighbours
+        ],
+        "region_paths": region_paths
+    }
+
+def is_admin_token(token):
+    """Whether token matches ADMIN_TOKEN; always False when no token is configured"""
+    return ADMIN_TOKEN is not None and token is not None and secrets.compare_digest(token, ADMIN_TOKEN)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Reject admin requests without the configured token"""
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/profiling/arm", dependencies=[Depends(require_admin)])
+async def arm_profiling(count: int = 1):
+    """Profile the next `count` /predict requests"""
+    if count < 0:
+        raise HTTPException(status_code=400, detail="count must not be negative")
+    profiler.arm(count)
+    return {"remaining": profiler.remaining}
+
+@app.post("/admin/profiling/disarm", dependencies=[Depends(require_admin)])
+async def disarm_profiling():
+    """Stop profiling armed requests"""
+    profiler.disarm()
+    return {"remaining": profiler.remaining}
+
+@app.get("/admin/profiling/traces", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """List the written trace files, newest first"""
+    return {"remaining": profiler.remaining, "traces": profiler.list_traces()}
+
+@app.get("/admin/profiling/traces/{name}", dependencies=[Depends(require_admin)])
+async def get_profile(name: str):
+    """Download a trace file"""
+    path = profiler.trace_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Trace not found: {name}")
+    return FileResponse(path)
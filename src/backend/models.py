@@ -4,10 +4,10 @@ import torchvision.models as models
 from torchvision.models import ResNet34_Weights
 
 class FeatureExtractor(nn.Module):
-    def __init__(self):
+    def __init__(self, pretrained=True):
         super(FeatureExtractor, self).__init__()
-        # Load a pre-trained ResNet34 model
-        base = models.resnet34(weights=ResNet34_Weights.IMAGENET1K_V1)
+        # Load a ResNet34 model, with ImageNet weights unless a checkpoint will be loaded
+        base = models.resnet34(weights=ResNet34_Weights.IMAGENET1K_V1 if pretrained else None)
         # Remove the final fully connected layer
         self.features = nn.Sequential(*list(base.children())[:-1])
         # Add the embedding layer that was in the saved model
@@ -26,4 +26,48 @@ class FeatureExtractor(nn.Module):
             return embedding
         # Otherwise, apply classifier and return predictions
         out = self.classifier(embedding)
-        return out 
\ No newline at end of file
+        return out
+
+class RegionHead(nn.Module):
+    def __init__(self, in_channels=256, hidden_channels=256, embedding_dim=256):
+        super(RegionHead, self).__init__()
+        # A single strided conv block replaces the 512-channel layer4 of ResNet34
+        self.block = nn.Sequential(
+            nn.Conv2d(in_channels, hidden_channels, kernel_size=3, stride=2, padding=1, bias=False),
+            nn.BatchNorm2d(hidden_channels),
+            nn.ReLU(inplace=True),
+        )
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.embedding = nn.Linear(hidden_channels, embedding_dim)
+        
+    def forward(self, x):
+        x = self.pool(self.block(x))
+        return self.embedding(torch.flatten(x, 1))
+
+class SharedBackboneExtractor(nn.Module):
+    """
+    Multi-region extractor with one ResNet34 trunk (up to layer3) shared by all
+    regions and a lightweight head per region, distilled to reproduce the 256-d
+    embeddings of the per-region FeatureExtractor models.
+    """
+    def __init__(self, regions, pretrained=True):
+        super(SharedBackboneExtractor, self).__init__()
+        base = models.resnet34(weights=ResNet34_Weights.IMAGENET1K_V1 if pretrained else None)
+        self.regions = list(regions)
+        self.trunk = nn.Sequential(
+            base.conv1, base.bn1, base.relu, base.maxpool,
+            base.layer1, base.layer2, base.layer3
+        )
+        self.heads = nn.ModuleDict({region: RegionHead() for region in self.regions})
+        
+    def forward(self, x, regions):
+        """Embed a batch of crops; regions[i] names the region head for x[i]"""
+        features = self.trunk(x)
+        embeddings = None
+        for region in dict.fromkeys(regions):
+            idx = torch.tensor([i for i, r in enumerate(regions) if r == region], device=x.device)
+            region_embeddings = self.heads[region](features[idx])
+            if embeddings is None:
+                embeddings = region_embeddings.new_empty(len(regions), region_embeddings.shape[1])
+            embeddings[idx] = region_embeddings
+        return embeddings
@@ -0,0 +1,185 @@
+import contextlib
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+
+import torch
+from torch.profiler import ProfilerActivity, profile, record_function
+
+logger = logging.getLogger(__name__)
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+# Files written for each profiled request
+TRACE_SUFFIXES = (".torch.json", ".python.json", ".ops.txt")
+
+
+class SamplingProfiler:
+    """Periodically samples the Python stack of a single thread from a background thread"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples.append((time.perf_counter(), stack[::-1]))
+            self._stop.wait(self.interval)
+
+    def chrome_trace(self):
+        """Merge consecutive identical frames at each stack depth into Chrome-trace complete events"""
+        events = []
+        open_frames = []
+        if not self.samples:
+            return {"traceEvents": events}
+        origin = self.samples[0][0]
+
+        def close(depth, end):
+            for name, start in open_frames[depth:]:
+                events.append({"name": name, "ph": "X", "pid": 0, "tid": self.thread_id,
+                               "ts": (start - origin) * 1e6, "dur": (end - start) * 1e6})
+            del open_frames[depth:]
+
+        for timestamp, stack in self.samples:
+            depth = 0
+            while depth < min(len(stack), len(open_frames)) and open_frames[depth][0] == stack[depth]:
+                depth += 1
+            close(depth, timestamp)
+            open_frames.extend((name, timestamp) for name in stack[depth:])
+        close(0, self.samples[-1][0] + self.interval)
+        return {"traceEvents": events}
+
+
+class RequestProfiler:
+    """
+    Opt-in profiler for live requests.
+
+    Profiling is armed for the next N requests (or requested per request) and
+    writes a torch.profiler Chrome trace, an operator summary and a Python
+    sampling profile per request to `output_dir`, keeping the traces of the
+    latest `max_traces` requests. When nothing is being profiled, `section`
+    returns a shared no-op context manager.
+    """
+
+    def __init__(self, output_dir, sample_interval=0.005, max_traces=20):
+        self.output_dir = Path(output_dir)
+        self.sample_interval = sample_interval
+        self.max_traces = max_traces
+        self.remaining = 0
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()
+        self._local = threading.local()
+
+    def arm(self, count):
+        with self._lock:
+            self.remaining = count
+        logger.info(f"Profiling armed for the next {count} requests")
+
+    def disarm(self):
+        self.arm(0)
+
+    def should_profile(self, requested=False):
+        """Whether to profile the current request, consuming one armed slot if used"""
+        if not requested and self.remaining <= 0:
+            return False
+        with self._lock:
+            if requested:
+                return True
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def section(self, name):
+        """Label a block in the torch trace while this thread is being profiled"""
+        if not getattr(self._local, "active", False):
+            return _NULL_CONTEXT
+        return record_function(name)
+
+    @contextlib.contextmanager
+    def profile(self, name):
+        """
+        Profile the enclosed block on the current thread and write its traces.
+        
+        Yields True if the block is traced, or False if another request is
+        already being profiled and the block runs unprofiled.
+        """
+        # Only one request is traced at a time; concurrent ones run unprofiled
+        if not self._busy.acquire(blocking=False):
+            logger.warning(f"Profiler busy, not profiling {name}")
+            yield False
+            return
+
+        timestamp = time.time()
+        trace_name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))}-{int(timestamp * 1000) % 1000:03d}_{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}"
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        sampler = SamplingProfiler(threading.get_ident(), self.sample_interval)
+        try:
+            with profile(activities=activities, record_shapes=True) as prof:
+                self._local.active = True
+                sampler.start()
+                try:
+                    yield True
+                finally:
+                    sampler.stop()
+                    self._local.active = False
+            prof.export_chrome_trace(str(self.output_dir / f"{trace_name}.torch.json"))
+            with open(self.output_dir / f"{trace_name}.python.json", "w") as f:
+                json.dump(sampler.chrome_trace(), f)
+            with open(self.output_dir / f"{trace_name}.ops.txt", "w") as f:
+                f.write(prof.key_averages().table(sort_by="cpu_time_total", row_limit=50))
+            logger.info(f"Wrote profile {trace_name} to {self.output_dir}")
+            self.prune()
+        finally:
+            self._busy.release()
+
+    def prune(self):
+        """Delete the files of all but the newest `max_traces` profiled requests"""
+        traces = {}
+        for path in self.output_dir.iterdir():
+            suffix = next((s for s in TRACE_SUFFIXES if path.name.endswith(s)), None)
+            if suffix is not None and path.is_file():
+                traces.setdefault(path.name[:-len(suffix)], []).append(path)
+        # Trace names start with a sortable timestamp
+        names = sorted(traces)
+        for name in names[:max(len(names) - self.max_traces, 0)]:
+            for path in traces[name]:
+                path.unlink(missing_ok=True)
+            logger.info(f"Deleted old profile {name}")
+
+    def list_traces(self):
+        if not self.output_dir.exists():
+            return []
+        return [
+            {"name": path.name, "size": path.stat().st_size, "modified": path.stat().st_mtime}
+            for path in sorted(self.output_dir.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
+            if path.is_file()
+        ]
+
+    def trace_path(self, name):
+        """Resolve a trace file name inside output_dir, or None if it does not exist"""
+        path = self.output_dir / Path(name).name
+        return path if path.is_file() else None
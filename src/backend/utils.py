@@ -1,14 +1,23 @@
 import torch
+import torch.nn.functional as F
 from torchvision import transforms
 from PIL import Image
 import numpy as np
 from pathlib import Path
+import io
 import logging
+import zipfile
 
-from .config import IMAGE_SIZE, CROP_SIZE, SELECTED_REGIONS, DATA_DIR
+from .config import (
+    IMAGE_SIZE, CROP_SIZE, SELECTED_REGIONS, DATA_DIR, IMAGE_DIR,
+    MAX_TENSOR_BATCH, MAX_TENSOR_SIDE, MAX_TENSOR_DECODED_BYTES
+)
 
 logger = logging.getLogger(__name__)
 
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
 def load_image(image_path: str) -> Image.Image:
     """Load and validate image file"""
     try:
@@ -34,7 +43,7 @@ def get_region_paths(filename):
     # For each region, check the corresponding directory
     for region in SELECTED_REGIONS:
         # Construct the path to the region-specific directory
-        region_dir = Path(f"data/images/temp/{region}")
+        region_dir = IMAGE_DIR / region
         logger.info(f"Looking in directory: {region_dir}")
         
         # Check if the directory exists
@@ -63,6 +72,34 @@ def get_region_paths(filename):
     
     return region_paths
 
+def load_reference_scans(data_dir=DATA_DIR):
+    """
+    List the labeled scans of the reference dataset.
+    
+    Labels are read from wholeBodyANT/wholeBodyANT.txt and only scans that have
+    an image for every selected region are returned, as (scan_id, label, region_paths).
+    """
+    data_dir = Path(data_dir)
+    label_file = data_dir / "wholeBodyANT" / "wholeBodyANT.txt"
+    if not label_file.exists():
+        raise FileNotFoundError(f"Label file does not exist: {label_file}")
+    
+    scans = []
+    with open(label_file, 'r') as f:
+        for line in f:
+            parts = line.strip().split()
+            if len(parts) != 2:
+                continue
+            img_name, label = parts[0], int(parts[1])
+            region_paths = {region: str(data_dir / region / img_name) for region in SELECTED_REGIONS}
+            if all(Path(path).exists() for path in region_paths.values()):
+                scans.append((Path(img_name).stem, label, region_paths))
+            else:
+                logger.warning(f"Skipping {img_name}: missing region images")
+    
+    logger.info(f"Found {len(scans)} labeled scans with all regions in {data_dir}")
+    return scans
+
 def preprocess_image(image: Image.Image) -> torch.Tensor:
     """Preprocess image for model inference"""
     transform = transforms.Compose([
@@ -70,8 +107,115 @@ def preprocess_image(image: Image.Image) -> torch.Tensor:
         transforms.CenterCrop(CROP_SIZE),
         transforms.ToTensor(),
         transforms.Normalize(
-            mean=[0.485, 0.456, 0.406],
-            std=[0.229, 0.224, 0.225]
+            mean=IMAGENET_MEAN,
+            std=IMAGENET_STD
         )
     ])
-    return transform(image).unsqueeze(0) 
\ No newline at end of file
+    return transform(image).unsqueeze(0)
+
+def preprocess_array(array: np.ndarray) -> torch.Tensor:
+    """
+    Preprocess a batch of grayscale uint8 crops of shape (N, H, W) directly as
+    tensors, matching preprocess_image on the equivalent RGB images to within
+    3/255 per pixel (PIL resizes in uint8, this resizes in float).
+    """
+    x = torch.from_numpy(np.ascontiguousarray(array)).unsqueeze(1).float().div_(255.0)
+    x = F.interpolate(x, size=(IMAGE_SIZE, IMAGE_SIZE), mode='bilinear', align_corners=False, antialias=True)
+    # Same offset as transforms.CenterCrop
+    top = int(round((IMAGE_SIZE - CROP_SIZE) / 2.0))
+    x = x[:, :, top:top + CROP_SIZE, top:top + CROP_SIZE].expand(-1, 3, -1, -1)
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+    return (x - mean) / std
+
+def _read_npy_header(fileobj):
+    """Read an .npy header, leaving fileobj at the start of the array data"""
+    version = np.lib.format.read_magic(fileobj)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(fileobj)
+    if version == (2, 0):
+        return np.lib.format.read_array_header_2_0(fileobj)
+    raise ValueError(f"Unsupported .npy format version {version}")
+
+def _check_region_header(region, shape, dtype, max_side):
+    """Validate one region's (H, W) or (B, H, W) header and return it as (B, H, W)"""
+    if len(shape) == 2:
+        shape = (1,) + shape
+    elif len(shape) != 3:
+        raise ValueError(f"Expected (H, W) or (B, H, W) array for {region}, got {shape}")
+    if dtype != np.uint8:
+        raise ValueError(f"Expected uint8 array for {region}, got {dtype}")
+    if 0 in shape[1:]:
+        raise ValueError(f"Expected non-empty crops for {region}, got {shape[1:]}")
+    if max(shape[1:]) > max_side:
+        raise ValueError(f"Crops for {region} exceed {max_side} pixels per side, got {shape[1:]}")
+    return shape
+
+def parse_region_arrays(
+    payload: bytes,
+    max_batch: int = MAX_TENSOR_BATCH,
+    max_side: int = MAX_TENSOR_SIDE,
+    max_decoded_bytes: int = MAX_TENSOR_DECODED_BYTES
+) -> dict:
+    """
+    Decode a binary region payload into a dict of region -> (B, H, W) uint8 arrays.
+    
+    The payload is either an .npy array of shape (regions, H, W) or
+    (B, regions, H, W) in SELECTED_REGIONS order, or an .npz archive with one
+    (H, W) or (B, H, W) array per region name. Shapes and dtypes are checked
+    against the limits from the array headers before anything is decoded.
+    """
+    if payload.startswith(np.lib.format.MAGIC_PREFIX):
+        fileobj = io.BytesIO(payload)
+        try:
+            npy_shape, fortran_order, dtype = _read_npy_header(fileobj)
+        except ValueError as e:
+            raise ValueError(f"Payload is not a valid .npy file: {str(e)}")
+        if len(npy_shape) not in (3, 4) or npy_shape[-3] != len(SELECTED_REGIONS):
+            raise ValueError(
+                f"Expected an array of shape ({len(SELECTED_REGIONS)}, H, W) or "
+                f"(B, {len(SELECTED_REGIONS)}, H, W), got {npy_shape}"
+            )
+        region_shape = _check_region_header("the regions", npy_shape[:-3] + npy_shape[-2:], dtype, max_side)
+        headers = {region: region_shape for region in SELECTED_REGIONS}
+        members = None
+    else:
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(payload))
+        except zipfile.BadZipFile:
+            raise ValueError("Payload is not a valid .npy or .npz file")
+        members = {Path(name).stem: name for name in archive.namelist() if name.endswith(".npy")}
+        missing = [region for region in SELECTED_REGIONS if region not in members]
+        if missing:
+            raise ValueError(f"Missing region arrays: {missing}")
+        headers = {}
+        for region in SELECTED_REGIONS:
+            try:
+                with archive.open(members[region]) as member:
+                    shape, fortran_order, dtype = _read_npy_header(member)
+            except (ValueError, zipfile.BadZipFile) as e:
+                raise ValueError(f"Invalid array for {region}: {str(e)}")
+            headers[region] = _check_region_header(region, shape, dtype, max_side)
+    
+    batch_sizes = {shape[0] for shape in headers.values()}
+    if len(batch_sizes) != 1 or 0 in batch_sizes:
+        raise ValueError(f"All regions must have the same non-zero batch size, got {sorted(batch_sizes)}")
+    n_scans = batch_sizes.pop()
+    if n_scans > max_batch:
+        raise ValueError(f"Batch of {n_scans} scans exceeds the limit of {max_batch}")
+    decoded_bytes = sum(int(np.prod(shape)) for shape in headers.values())
+    if decoded_bytes > max_decoded_bytes:
+        raise ValueError(f"Arrays decode to {decoded_bytes} bytes, over the limit of {max_decoded_bytes}")
+    
+    try:
+        if members is None:
+            data = np.load(io.BytesIO(payload), allow_pickle=False).reshape((n_scans,) + npy_shape[-3:])
+            return {region: data[:, i] for i, region in enumerate(SELECTED_REGIONS)}
+        region_arrays = {}
+        with archive:
+            for region in SELECTED_REGIONS:
+                with archive.open(members[region]) as member:
+                    region_arrays[region] = np.lib.format.read_array(member, allow_pickle=False).reshape(headers[region])
+        return region_arrays
+    except (ValueError, OSError, EOFError, zipfile.BadZipFile) as e:
+        raise ValueError(f"Could not decode region arrays: {str(e)}")
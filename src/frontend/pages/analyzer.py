@@ -167,16 +167,24 @@ if uploaded_file:
                     # Display results in the results column
                     with results_col:
                         st.success("Analysis Complete!")
-                                                
-                        st.metric(
-                            "Metastasis Probability",
-                            f"{result['probability_positive']:.1%}"
-                        )
                         
-                        st.metric(
-                            "Normal Probability",
-                            f"{result['probability_negative']:.1%}"
-                        )
+                        if result.get('path') == "cascade":
+                            # Early exits carry a calibrated decision, not a probability
+                            st.metric("Result", "Early exit (cascade)")
+                            st.caption(
+                                f"Decided from {len(result['regions_evaluated'])} regions "
+                                "without running the full model."
+                            )
+                        else:
+                            st.metric(
+                                "Metastasis Probability",
+                                f"{result['probability_positive']:.1%}"
+                            )
+                            
+                            st.metric(
+                                "Normal Probability",
+                                f"{result['probability_negative']:.1%}"
+                            )
                         
                         prediction = "Positive" if result['prediction'] > 0.5 else "Negative"
                         st.metric("Final Prediction", prediction)
@@ -0,0 +1,139 @@
+import asyncio
+import os
+
+import pytest
+
+from src.backend import cache
+from src.backend.cache import ResultCache, SingleFlight, file_fingerprint
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+
+def test_result_cache_expires_entries_after_ttl(clock):
+    results = ResultCache(maxsize=4, ttl=10.0)
+    results.put("a", 1)
+
+    clock.now += 9.9
+    assert results.get("a") == 1
+    clock.now += 0.2
+    assert results.get("a") is None
+    assert results.stats()["size"] == 0
+    assert (results.hits, results.misses) == (1, 1)
+
+
+def test_result_cache_evicts_least_recently_used(clock):
+    results = ResultCache(maxsize=2, ttl=10.0)
+    results.put("a", 1)
+    results.put("b", 2)
+    results.get("a")
+    results.put("c", 3)
+
+    assert results.get("b") is None
+    assert results.get("a") == 1
+    assert results.get("c") == 3
+
+
+def test_result_cache_with_zero_size_stores_nothing(clock):
+    results = ResultCache(maxsize=0, ttl=10.0)
+    results.put("a", 1)
+
+    assert results.get("a") is None
+    assert results.stats()["size"] == 0
+
+
+def test_file_fingerprint_changes_with_mtime_and_size(tmp_path):
+    path = tmp_path / "region.jpg"
+    path.write_bytes(b"scan")
+    original = file_fingerprint([path])
+    assert file_fingerprint([path]) == original
+
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    touched = file_fingerprint([path])
+    assert touched != original
+
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    path.write_bytes(b"scan plus more")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert file_fingerprint([path]) != touched
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", compute) for _ in range(3)))
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [("result", False), ("result", True), ("result", True)]
+    assert flights.stats() == {"in_flight": 0, "coalesced": 2}
+
+
+def test_single_flight_propagates_errors_to_followers():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", fail) for _ in range(2)), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_single_flight_runs_again_after_completion():
+    flights = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    async def run():
+        first = await flights.do("key", compute)
+        second = await flights.do("key", compute)
+        return first, second
+
+    assert asyncio.run(run()) == ((1, False), (2, False))
+
+
+def test_prediction_cache_key_tracks_region_files(tmp_path):
+    pytest.importorskip("torch")
+    pytest.importorskip("fastapi")
+    from src.backend import main
+
+    region_paths = {}
+    for region in ("headANT", "pelvisANT"):
+        region_paths[region] = tmp_path / f"{region}.jpg"
+        region_paths[region].write_bytes(b"scan")
+    key = main.prediction_cache_key("scan", region_paths, False)
+    assert main.prediction_cache_key("scan", region_paths, False) == key
+    assert main.prediction_cache_key("scan", region_paths, True) != key
+
+    region_paths["pelvisANT"].write_bytes(b"rewritten scan")
+    assert main.prediction_cache_key("scan", region_paths, False) != key
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("fastapi")
+
+from fastapi.testclient import TestClient
+
+from src.backend import main
+from src.backend.cascade import Cascade, cascade_decisions, select_thresholds
+from src.backend.config import SELECTED_REGIONS
+
+
+class FixedScoreClassifier:
+    def __init__(self, score):
+        self.score = score
+
+    def predict_proba(self, features):
+        return np.array([[1.0 - self.score, self.score]] * len(features))
+
+
+@pytest.fixture
+def synthetic_calibration():
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 2, 4000)
+    scores = np.clip(0.5 * labels + rng.normal(0.25, 0.2, len(labels)), 0, 1)
+    full_decisions = (scores + rng.normal(0, 0.1, len(labels)) > 0.5).astype(int)
+    return scores, full_decisions, labels
+
+
+@pytest.mark.parametrize("max_sensitivity_drop", [0.0, 0.01, 0.05])
+def test_select_thresholds_respects_sensitivity_bound(synthetic_calibration, max_sensitivity_drop):
+    scores, full_decisions, labels = synthetic_calibration
+    low, high = select_thresholds(scores, full_decisions, labels, max_sensitivity_drop)
+    decisions = cascade_decisions(scores, full_decisions, low, high)
+
+    assert high is None
+    positives = labels == 1
+    assert full_decisions[positives].mean() - decisions[positives].mean() <= max_sensitivity_drop + 1e-9
+    # Negative exits only ever flip decisions to 0
+    assert np.all(decisions <= full_decisions)
+
+
+def test_select_thresholds_respects_specificity_bound(synthetic_calibration):
+    scores, full_decisions, labels = synthetic_calibration
+    low, high = select_thresholds(scores, full_decisions, labels, 0.01, max_specificity_drop=0.01)
+    decisions = cascade_decisions(scores, full_decisions, low, high)
+
+    assert high is not None and high >= low
+    negatives = labels == 0
+    assert decisions[negatives].mean() - full_decisions[negatives].mean() <= 0.01 + 1e-9
+
+
+def test_cascade_decisions():
+    scores = np.array([0.1, 0.5, 0.9])
+    assert cascade_decisions(scores, np.array([1, 1, 0]), 0.2).tolist() == [0, 1, 0]
+    assert cascade_decisions(scores, np.array([1, 0, 0]), 0.2, 0.8).tolist() == [0, 0, 1]
+
+
+@pytest.mark.parametrize("score, low, high, expected", [
+    (0.55, 0.6, None, 0.0),
+    (0.45, 0.1, 0.4, 1.0),
+])
+def test_early_exit_reports_calibrated_decision(monkeypatch, score, low, high, expected):
+    regions = SELECTED_REGIONS[:2]
+    monkeypatch.setattr(main, "cascade", Cascade(regions, FixedScoreClassifier(score), low, high))
+    monkeypatch.setattr(main, "extract_region_embeddings",
+                        lambda region_paths, regions=SELECTED_REGIONS: {r: np.zeros(256) for r in regions})
+
+    result = main.run_prediction({}, use_cascade=True)
+
+    assert result["path"] == "cascade"
+    assert result["prediction"] == expected
+    assert result["probability_positive"] is None
+    assert result["probability_negative"] is None
+    assert result["cascade_score"] == pytest.approx(score)
+
+
+def test_uncertain_score_falls_through_to_full_path(monkeypatch):
+    monkeypatch.setattr(main, "cascade", Cascade(SELECTED_REGIONS[:2], FixedScoreClassifier(0.5), 0.2, 0.8))
+    monkeypatch.setattr(main, "extract_region_embeddings",
+                        lambda region_paths, regions=SELECTED_REGIONS: {r: np.zeros(256) for r in regions})
+    monkeypatch.setattr(main, "rf_classifier", FixedScoreClassifier(0.7), raising=False)
+
+    result = main.run_prediction({}, use_cascade=True)
+
+    assert result["path"] == "full"
+    assert result["prediction"] == pytest.approx(0.7)
+    assert "cascade_score" not in result
+
+
+def test_cascade_default_without_artifact_uses_full_path(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, "cascade", None)
+    monkeypatch.setattr(main, "CASCADE_ENABLED", True)
+    monkeypatch.setattr(main, "get_region_paths", lambda filename: {r: f"{r}.jpg" for r in SELECTED_REGIONS})
+    monkeypatch.setattr(main, "file_fingerprint", lambda paths: tuple(paths))
+    monkeypatch.setattr(main, "result_cache", main.ResultCache(maxsize=0))
+
+    def fake_run_prediction(region_paths, use_cascade):
+        calls.append(use_cascade)
+        return {"prediction": 0.2, "path": "full"}
+
+    monkeypatch.setattr(main, "run_prediction", fake_run_prediction)
+    client = TestClient(main.app)
+    files = {"file": ("scan.jpg", b"scan", "image/jpeg")}
+
+    assert client.post("/predict", files=files).status_code == 200
+    assert calls == [False]
+    assert client.post("/predict?use_cascade=true", files=files).status_code == 503
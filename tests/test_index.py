@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from src.backend.index import EmbeddingIndex
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(40, 96))
+    x = centers[rng.integers(0, len(centers), 2000)] + 0.5 * rng.normal(size=(2000, 96))
+    return x.astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def index(embeddings):
+    index = EmbeddingIndex(embeddings.shape[1], nlist=32, m=24)
+    index.train(embeddings, max_samples=1500)
+    index.add(embeddings, [f"scan_{i}" for i in range(len(embeddings))], np.arange(len(embeddings)) % 2)
+    return index
+
+
+def exact_neighbours(embeddings, query, k):
+    x = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    q = query / np.linalg.norm(query)
+    return set(np.argsort(-(x @ q))[:k])
+
+
+def recall_at_k(index, embeddings, k=5, n_queries=50, **search_kwargs):
+    hits = 0
+    for i in range(n_queries):
+        found = {int(scan_id.split("_")[1]) for scan_id, _, _ in index.search(embeddings[i], k=k, **search_kwargs)}
+        hits += len(found & exact_neighbours(embeddings, embeddings[i], k))
+    return hits / (k * n_queries)
+
+
+def test_search_returns_labeled_neighbours(index, embeddings):
+    results = index.search(embeddings[3], k=5, nprobe=8)
+    assert len(results) == 5
+    assert results[0][0] == "scan_3"
+    assert results[0][1] == 1
+    assert results[0][2] == pytest.approx(1.0, abs=1e-2)
+    similarities = [similarity for _, _, similarity in results]
+    assert similarities == sorted(similarities, reverse=True)
+
+
+def test_reranking_recall(index, embeddings):
+    assert recall_at_k(index, embeddings, nprobe=8) >= 0.9
+    assert recall_at_k(index, embeddings, nprobe=8) > recall_at_k(index, embeddings, nprobe=8, rerank=0)
+
+
+def test_save_load_round_trip(index, embeddings, tmp_path):
+    index.extractor = "ensemble"
+    index.save(tmp_path)
+    loaded = EmbeddingIndex.load(tmp_path)
+
+    assert len(loaded) == len(index)
+    assert loaded.extractor == "ensemble"
+    assert isinstance(loaded.codes, np.memmap)
+    assert isinstance(loaded.vectors, np.memmap)
+    for i in range(10):
+        assert loaded.search(embeddings[i], k=5, nprobe=8) == index.search(embeddings[i], k=5, nprobe=8)
+
+
+def test_add_after_load(index, embeddings, tmp_path):
+    index.save(tmp_path)
+    loaded = EmbeddingIndex.load(tmp_path)
+    loaded.add(embeddings[:2] + 0.01, ["new_0", "new_1"], [1, 0])
+
+    assert len(loaded) == len(embeddings) + 2
+    ids = [scan_id for scan_id, _, _ in loaded.search(embeddings[0], k=3, nprobe=8)]
+    assert "new_0" in ids
+
+    loaded.save(tmp_path / "appended")
+    assert len(EmbeddingIndex.load(tmp_path / "appended")) == len(embeddings) + 2
@@ -0,0 +1,116 @@
+import io
+import zipfile
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("fastapi")
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from src.backend import main
+from src.backend.config import SELECTED_REGIONS
+from src.backend.utils import IMAGENET_STD, parse_region_arrays, preprocess_array, preprocess_image
+
+
+def npy_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def npz_bytes(arrays):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def test_parses_single_scan_npy():
+    crops = np.arange(len(SELECTED_REGIONS) * 20, dtype=np.uint8).reshape(len(SELECTED_REGIONS), 4, 5)
+
+    region_arrays = parse_region_arrays(npy_bytes(crops))
+
+    for i, region in enumerate(SELECTED_REGIONS):
+        assert region_arrays[region].shape == (1, 4, 5)
+        np.testing.assert_array_equal(region_arrays[region][0], crops[i])
+
+
+def test_parses_batched_npy():
+    crops = np.random.default_rng(0).integers(0, 256, size=(3, len(SELECTED_REGIONS), 4, 5), dtype=np.uint8)
+
+    region_arrays = parse_region_arrays(npy_bytes(crops))
+
+    for i, region in enumerate(SELECTED_REGIONS):
+        np.testing.assert_array_equal(region_arrays[region], crops[:, i])
+
+
+def test_parses_per_region_npz_with_different_sizes():
+    arrays = {region: np.full((2, 3 + i, 4), i, dtype=np.uint8) for i, region in enumerate(SELECTED_REGIONS)}
+
+    region_arrays = parse_region_arrays(npz_bytes(arrays))
+
+    for region, array in arrays.items():
+        np.testing.assert_array_equal(region_arrays[region], array)
+
+
+@pytest.mark.parametrize("payload, message", [
+    (npy_bytes(np.zeros((len(SELECTED_REGIONS), 4, 4), dtype=np.float32)), "uint8"),
+    (npz_bytes({region: np.zeros((1 + (i == 0), 4, 4), dtype=np.uint8)
+                for i, region in enumerate(SELECTED_REGIONS)}), "batch size"),
+    (npy_bytes(np.zeros((len(SELECTED_REGIONS), 0, 4), dtype=np.uint8)), "non-empty"),
+    (npz_bytes({SELECTED_REGIONS[0]: np.zeros((4, 4), dtype=np.uint8)}), "Missing region"),
+    (npy_bytes(np.zeros((4, 4), dtype=np.uint8)), "Expected an array of shape"),
+    (b"not an array", "not a valid"),
+])
+def test_rejects_invalid_payloads(payload, message):
+    with pytest.raises(ValueError, match=message):
+        parse_region_arrays(payload)
+
+
+def test_rejects_oversized_arrays_before_decoding():
+    # Each member claims a huge array but holds almost no data, like a decompression bomb
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for region in SELECTED_REGIONS:
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(
+                header, {"descr": "|u1", "fortran_order": False, "shape": (200, 1000, 1000)})
+            archive.writestr(f"{region}.npy", header.getvalue())
+
+    with pytest.raises(ValueError, match="over the limit"):
+        parse_region_arrays(buffer.getvalue())
+    with pytest.raises(ValueError, match="exceeds the limit"):
+        parse_region_arrays(npy_bytes(np.zeros((3, len(SELECTED_REGIONS), 4, 4), dtype=np.uint8)), max_batch=2)
+    with pytest.raises(ValueError, match="pixels per side"):
+        parse_region_arrays(npy_bytes(np.zeros((len(SELECTED_REGIONS), 4, 64), dtype=np.uint8)), max_side=32)
+
+
+@pytest.mark.parametrize("size", [(300, 280), (200, 180)])
+def test_preprocess_array_matches_preprocess_image(size):
+    # Smooth crop, so the comparison measures rounding rather than filter edge effects
+    coarse = np.random.default_rng(0).integers(0, 256, size=(12, 12), dtype=np.uint8)
+    crop = np.asarray(Image.fromarray(coarse).resize(size[::-1], Image.BILINEAR))
+
+    from_array = preprocess_array(crop[None])
+    from_image = preprocess_image(Image.fromarray(crop).convert("RGB"))
+
+    assert from_array.shape == from_image.shape
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+    pixel_diff = ((from_array - from_image) * std).abs()
+    assert pixel_diff.max().item() <= 3 / 255
+    assert pixel_diff.mean().item() <= 1 / 255
+
+
+def test_tensor_endpoint_rejects_large_and_invalid_bodies(monkeypatch):
+    monkeypatch.setattr(main, "MAX_TENSOR_PAYLOAD_BYTES", 1024)
+    client = TestClient(main.app)
+
+    too_large = npy_bytes(np.zeros((len(SELECTED_REGIONS), 32, 32), dtype=np.uint8))
+    assert client.post("/predict/tensor", content=too_large).status_code == 413
+
+    empty_crops = npy_bytes(np.zeros((len(SELECTED_REGIONS), 0, 4), dtype=np.uint8))
+    response = client.post("/predict/tensor", content=empty_crops)
+    assert response.status_code == 400
+    assert "non-empty" in response.json()["detail"]